@@ -1,9 +1,9 @@
-from . import magma
 from .ssam import SsamEW
 
-from pkg_resources import get_distribution
+from importlib import import_module
+from importlib.metadata import version
 
-__version__ = get_distribution("ssam-ew").version
+__version__ = version("ssam-ew")
 __author__ = "Martanto"
 __author_email__ = "martanto@live.com"
 __license__ = "MIT"
@@ -14,4 +14,12 @@ __url__ = "https://github.com/martanto/ssam-ew"
 __all__ = [
     'SsamEW',
     'magma',
-]
\ No newline at end of file
+]
+
+
+def __getattr__(name: str):
+    # MAGMA client pulls in requests, so only import it when it is used
+    if name == 'magma':
+        return import_module('.magma', __name__)
+
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
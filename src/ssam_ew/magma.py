@@ -1,15 +1,20 @@
 
+from .utils import ensure_dir
 from typing import Tuple
 from datetime import datetime, timedelta, timezone
 from pandas.errors import EmptyDataError
 from pathlib import Path
 
 import os
-import json
+import orjson
+import time
+import hashlib
+import numpy as np
 import pandas as pd
 import requests
 import matplotlib.pyplot as plt
 import matplotlib.dates as mdates
+import matplotlib.ticker as mticker
 
 colors: dict[str, str] = {
     'Letusan/Erupsi': '#F44336',
@@ -30,6 +35,7 @@ colors: dict[str, str] = {
     'Double Event': '#ff5722',
     'Getaran Banjir': '#795548',
     'Harmonik': '#607d8b',
+    'Deep Tremor': '#263238',
     'Tremor Menerus': '#9E9E9E',
 }
 
@@ -56,6 +62,14 @@ columns: dict[str, str] = {
     'gempa.tremor_menerus': 'Tremor Menerus'
 }
 
+earthquake_codes: frozenset[str] = frozenset({
+    '*', 'lts', 'apl', 'apg', 'gug', 'hbs', 'hrm', 'tre', 'tor', 'lof', 'hyb',
+    'vtb', 'vta', 'vlp', 'tel', 'trs', 'tej', 'dev', 'gtb', 'dpt', 'mtr',
+})
+
+# Cached MAGMA responses older than this (seconds) are requested again
+cache_expire: int = 86400
+
 
 class Auth:
     url_login = 'https://magma.esdm.go.id/api/login'
@@ -82,7 +96,7 @@ class Auth:
         headers = {'Authorization': 'Bearer ' + self.token}
 
         try:
-            response = requests.request("GET", self.url_validate_token, headers=headers).json()
+            response = orjson.loads(self.request("GET", self.url_validate_token, headers=headers).content)
             self.expired = datetime.fromtimestamp(response['exp'], timezone.utc)
         except Exception as e:
             raise f'Error validating token: {e}'
@@ -94,15 +108,15 @@ class Auth:
         return True
 
     def login(self, username: str, password: str) -> str:
-        payload = json.dumps({
+        payload = orjson.dumps({
             "username": username,
             "password": password
-        })
+        }).decode()
 
         headers = {'Content-Type': 'application/json'}
 
         try:
-            response = requests.request("POST", self.url_login, headers=headers, data=payload).json()
+            response = orjson.loads(self.request("POST", self.url_login, headers=headers, data=payload).content)
         except Exception as e:
             raise f'Error login with username and password: {e}'
 
@@ -111,29 +125,55 @@ class Auth:
 
         return response['token']
 
+    @staticmethod
+    def request(method: str, url: str, attempts: int = 3, backoff: float = 0.3, **kwargs) -> requests.Response:
+        """Send HTTP request, retrying on connection errors and server errors (5xx).
+
+        Args:
+            method (str): HTTP method
+            url (str): URL
+            attempts (int, optional): Number of attempts. Defaults to 3.
+            backoff (float, optional): Seconds to wait between attempts. Defaults to 0.3.
+
+        Returns:
+            requests.Response: Response
+        """
+        for attempt in range(1, attempts + 1):
+            try:
+                response = requests.request(method, url, **kwargs)
+            except requests.RequestException:
+                if attempt == attempts:
+                    raise
+            else:
+                if response.status_code < 500 or attempt == attempts:
+                    return response
+            time.sleep(backoff)
+
 
 class Plot(Auth):
     url_evaluasi = 'https://magma.esdm.go.id/api/v1/python/magma-var/evaluasi'
 
     def __init__(self, token: str, volcano_code: str = None, start_date: str = None, end_date: str = None,
-                 earthquake_events: str | list[str] = None, current_dir: str = None) -> None:
+                 earthquake_events: str | list[str] = None, current_dir: str = None, use_cache: bool = True) -> None:
 
         super().__init__(token)
         self.volcano_code = volcano_code
         self.start_date = start_date
         self.end_date = end_date
         self.earthquake_events: list[str] = Plot.validate_earthquake_events(earthquake_events)
-
-        self.json: dict = self.get_json_response()
-        self.df: pd.DataFrame = self.get_df()
-        self.events_not_recorded = self.df.columns[self.df.sum() == 0]
-        self.filename = 'magma_{}_{}_{}'.format(self.volcano_code, self.start_date, self.end_date)
+        self.use_cache = use_cache
 
         self.current_dir = current_dir
         if self.current_dir is None:
             self.current_dir = os.getcwd()
 
         self.output_dir, self.figures_dir, self.magma_dir = self.check_directory()
+        self.cache_dir = os.path.join(self.output_dir, '.http_cache')
+        ensure_dir(self.cache_dir)
+
+        self.df: pd.DataFrame = self.get_df(self.get_json_response())
+        self.events_not_recorded = self.df.columns[self.df.sum() == 0]
+        self.filename = 'magma_{}_{}_{}'.format(self.volcano_code, self.start_date, self.end_date)
 
         if start_date is None:
             self.start_date: str = datetime.today().strftime('%Y-%m-%d')
@@ -149,13 +189,13 @@ class Plot(Auth):
             current_dir = self.current_dir
 
         output_dir = os.path.join(current_dir, 'output')
-        os.makedirs(output_dir, exist_ok=True)
+        ensure_dir(output_dir)
 
         figures_dir = os.path.join(current_dir, 'figures')
-        os.makedirs(figures_dir, exist_ok=True)
+        ensure_dir(figures_dir)
 
         magma_dir = os.path.join(output_dir, 'magma')
-        os.makedirs(magma_dir, exist_ok=True)
+        ensure_dir(magma_dir)
 
         return output_dir, figures_dir, magma_dir
 
@@ -167,48 +207,35 @@ class Plot(Auth):
         if isinstance(earthquake_events, str):
             earthquake_events = [earthquake_events]
 
-        for earthquake_event in earthquake_events:
-            if earthquake_event not in ['*', 'lts', 'apl', 'apg', 'gug', 'hbs', 'hrm', 'tre',
-                                        'tor', 'lof', 'hyb', 'vtb', 'vta', 'vlp', 'tel', 'trs',
-                                        'tej', 'dev', 'gtb', 'dpt', 'mtr']:
-                raise ValueError("Earthquake_events must be one of '*', 'lts', 'apl', 'apg', 'gug', 'hbs', 'hrm', "
-                                 "'tre', 'tor', 'lof', 'hyb', 'vtb', 'vta','vlp', 'tel', 'trs', 'tej', 'dev', 'gtb', "
-                                 "'dpt', 'mtr'")
+        invalid_events = set(earthquake_events) - earthquake_codes
+        if invalid_events:
+            raise ValueError("Earthquake_events must be one of '*', 'lts', 'apl', 'apg', 'gug', 'hbs', 'hrm', "
+                             "'tre', 'tor', 'lof', 'hyb', 'vtb', 'vta','vlp', 'tel', 'trs', 'tej', 'dev', 'gtb', "
+                             "'dpt', 'mtr'. Got {}".format(sorted(invalid_events)))
 
         return earthquake_events
 
     def get_df(self, json_response: dict = None) -> pd.DataFrame:
         if json_response is None:
-            json_response = self.json
-
-        df = pd.json_normalize(json_response['data'])
-        df.drop(columns=[
-            'availability',
-            'visual.visibility',
-            'visual.cuaca',
-            'visual.asap.teramati',
-            'visual.asap.warna',
-            'visual.asap.intensitas',
-            'visual.asap.tekanan',
-            'visual.asap.tinggi_min',
-            'visual.asap.tinggi_max',
-            'visual.letusan.teramati',
-            'visual.letusan.tinggi_min',
-            'visual.letusan.tinggi_max',
-            'visual.letusan.warna',
-            'visual.awan_panas_guguran.teramati',
-            'visual.awan_panas_guguran.jarak_min',
-            'visual.awan_panas_guguran.jarak_max'
-        ], inplace=True)
-
-        df.drop(columns=df.columns[df.sum() == 0], inplace=True)
-        df.set_index(keys='date', inplace=True)
-        df.index = pd.to_datetime(df.index)
-
-        df.rename(columns=columns, inplace=True)
-
-        if 'Tremor Menerus' in df.columns:
-            df.drop(columns=['Tremor Menerus'], inplace=True)
+            json_response = self.get_json_response()
+
+        records = json_response['data']
+        event_keys = [column.removeprefix('gempa.') for column in columns if column != 'gempa.tremor_menerus']
+
+        # Fill daily counts straight into a typed array; daily counts fit in uint16
+        counts = np.zeros((len(records), len(event_keys)), dtype=np.uint16)
+        for row, record in enumerate(records):
+            gempa = record.get('gempa', {})
+            counts[row] = [gempa.get(key) or 0 for key in event_keys]
+
+        # Keep only recorded events
+        recorded = counts.sum(axis=0) > 0
+
+        df = pd.DataFrame(
+            counts[:, recorded],
+            index=pd.DatetimeIndex([record['date'] for record in records], name='date'),
+            columns=[columns[f'gempa.{key}'] for key, is_recorded in zip(event_keys, recorded) if is_recorded],
+        )
 
         return df
 
@@ -219,12 +246,12 @@ class Plot(Auth):
 
         url = self.url_evaluasi
 
-        payload = json.dumps({
+        payload = orjson.dumps({
             "start_date": self.start_date,
             "end_date": self.end_date,
             "code_ga": self.volcano_code,
             "gempa": self.earthquake_events
-        })
+        }).decode()
 
         headers = {
             'Authorization': 'Bearer ' + token,
@@ -241,8 +268,16 @@ class Plot(Auth):
         if (end_date_object > datetime.now()) or (start_date_object > datetime.now()):
             raise ValueError('End date or start date must be greter than today ({})'.format(datetime.today().date()))
 
+        cache_file = os.path.join(self.cache_dir, '{}.json'.format(hashlib.sha1(payload.encode()).hexdigest()))
+        if self.use_cache and os.path.isfile(cache_file):
+            if time.time() - os.path.getmtime(cache_file) < cache_expire:
+                with open(cache_file, 'rb') as f:
+                    return orjson.loads(f.read())
+
         try:
-            response = requests.request("GET", url, headers=headers, data=payload).json()
+            http_response = self.request("GET", url, headers=headers, data=payload)
+            content = http_response.content
+            response = orjson.loads(content)
         except Exception as e:
             raise ValueError(f'Please check your token or parameters {payload}. Error: {e}')
 
@@ -250,6 +285,11 @@ class Plot(Auth):
             if response['code'] == 401:
                 raise ValueError(f'Please update your token at https://magma.esdm.go.id/chambers/token')
 
+        # Only successful responses are replayed, errors must reach the API again next time
+        if self.use_cache and http_response.ok and 'data' in response:
+            with open(cache_file, 'wb') as f:
+                f.write(content)
+
         return response
 
     def download(self) -> str:
@@ -261,7 +301,7 @@ class Plot(Auth):
         if not self.df.empty:
             try:
                 csv = os.path.join(self.magma_dir, "{}.csv".format(self.filename))
-                self.df.to_csv(csv)
+                self.df.to_csv(csv, float_format='%.0f')
                 self.csv = csv
                 print(f'💾 Saved to {csv}')
 
@@ -295,27 +335,34 @@ class Plot(Auth):
 
         filename = Path(csv).stem
 
-        df = pd.read_csv(csv, index_col='date', parse_dates=True)
+        df = pd.read_csv(csv, index_col='date', parse_dates=True, engine='pyarrow')
 
-        fig, axs = plt.subplots(nrows=len(df.columns), ncols=1, figsize=(12, 1 * len(df.columns)), sharex=True)
+        fig, axs = plt.subplots(nrows=len(df.columns), ncols=1, figsize=(12, 1 * len(df.columns)),
+                                sharex=True, squeeze=False)
+        axs = axs[:, 0]
 
         plt.subplots_adjust(hspace=0.0)
 
-        for gempa, column_name in enumerate(df.columns):
-            Plot.ax(
-                ax=axs[gempa],
-                df=df,
-                column_name=column_name,
-                width=width,
-                interval=interval
-            )
+        Plot.plot_events(
+            axs=axs,
+            x=mdates.date2num(df.index.to_numpy()),
+            y=df.to_numpy(),
+            labels=list(df.columns),
+            width=width,
+            interval=interval,
+            legend_fontsize=8
+        )
+
+        axs[-1].xaxis.set_major_formatter(mdates.DateFormatter('%Y-%m-%d'))
+        axs[-1].set_xlim(df.first_valid_index(), df.last_valid_index())
+        fig.autofmt_xdate(rotation=30, ha='right')
 
         fig.supylabel('Jumlah', x=0.07)
         fig.suptitle(title, fontsize=12, y=0.92)
 
         if save_plot:
             figures_dir = os.path.join(os.getcwd(), 'figures')
-            os.makedirs(figures_dir, exist_ok=True)
+            ensure_dir(figures_dir)
 
             figure_name = os.path.join(figures_dir, f'{filename}.png')
             fig.savefig(figure_name, dpi=dpi)
@@ -345,11 +392,50 @@ class Plot(Auth):
             dpi=dpi
         )
 
+    @staticmethod
+    def plot_events(axs: np.ndarray, x: np.ndarray, y: np.ndarray, labels: list[str], width: float = 0.5,
+                    interval: int = 1, y_locator: int = None, legend_fontsize: float = None) -> np.ndarray:
+        """Plot event counts as bar subplots sharing the x axis.
+
+        Args:
+            axs (np.ndarray): Axes, one per event
+            x (np.ndarray): Dates as matplotlib date numbers
+            y (np.ndarray): Counts, one column per event
+            labels (list[str]): Event names, in the same order as y columns
+            width (float, optional): Width of column bar. Defaults to 0.5.
+            interval (int, optional): Xtick label interval (day). Defaults to 1.
+            y_locator (int, optional): Y tick interval, applied when counts exceed it. Defaults to None.
+            legend_fontsize (float, optional): Legend font size. Defaults to None.
+
+        Returns:
+            np.ndarray: Axes
+        """
+        color_list = [colors[label] for label in labels]
+        y_max = y.max(axis=0)
+
+        for gempa, label in enumerate(labels):
+            axs[gempa].bar(x, y[:, gempa], width=width, label=label, color=color_list[gempa], linewidth=0)
+            axs[gempa].set_ylim([0, y_max[gempa] * 1.2])
+
+            if y_locator is not None and y_max[gempa] > y_locator:
+                axs[gempa].yaxis.set_major_locator(mticker.MultipleLocator(y_locator))
+
+            axs[gempa].yaxis.get_major_ticks()[0].label1.set_visible(False)
+            axs[gempa].legend(loc=2, fontsize=legend_fontsize)
+
+        # Axes share x, so date ticks are set once on the bottom axis
+        axs[-1].xaxis_date()
+        axs[-1].xaxis.set_major_locator(mdates.DayLocator(interval=interval))
+
+        return axs
+
     @staticmethod
     def ax(ax: plt.Axes, df: pd.DataFrame, column_name: str, width: float = 0.5, interval=1) -> plt.Axes:
 
-        ax.bar(df.index, df[column_name], width=width, label=column_name,
+        # Numeric dates skip matplotlib's per-element datetime conversion
+        ax.bar(mdates.date2num(df.index.to_numpy()), df[column_name], width=width, label=column_name,
                color=colors[column_name], linewidth=0)
+        ax.xaxis_date()
 
         ax.legend(loc=2, fontsize=8)
 
@@ -1,5 +1,6 @@
-from .magma import Plot, colors
+from .utils import ensure_dir
 from zipfile import ZipFile, ZipInfo
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from typing import Tuple
 from pathlib import Path
@@ -7,10 +8,13 @@ from pandas import DatetimeIndex
 
 import pandas as pd
 import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pacsv
 import os
 import matplotlib.pyplot as plt
 import matplotlib.dates as mdates
-import matplotlib.ticker as mticker
+from matplotlib.collections import QuadMesh
 
 month_translator = {
     'Mei': 'May',
@@ -22,7 +26,8 @@ month_translator = {
 
 class SsamEW:
     def __init__(self, zip_file_location: str, station: str, channel: str, network: str = None, location: str = None,
-                 wildcard: str = '.dat', delimiter=' ', combine_data: bool = False, current_dir: str = None, input_dir: str = None) -> None:
+                 wildcard: str = '.dat', delimiter=' ', combine_data: bool = False, current_dir: str = None, input_dir: str = None,
+                 save_merged: bool = False, merged_format: str = 'parquet') -> None:
 
         if current_dir is None:
             current_dir = os.getcwd()
@@ -30,7 +35,7 @@ class SsamEW:
 
         if input_dir is None:
             input_dir = os.path.join(current_dir, 'input')
-            os.makedirs(input_dir, exist_ok=True)
+            ensure_dir(input_dir)
 
         self.network = 'VG' if network is None else network
         self.station = station
@@ -42,6 +47,15 @@ class SsamEW:
         self.wildcard = wildcard
         self.delimiter = delimiter
 
+        if merged_format not in ['parquet', 'csv']:
+            raise ValueError("merged_format must be one of 'parquet', 'csv'")
+
+        self.save_merged = save_merged
+        self.merged_format = merged_format
+
+        # Last get_df result, keyed by the daily files it read and their modification times
+        self._df_cache: dict[tuple, pd.DataFrame] = {}
+
         self.output_dir, self.figures_dir, self.ssam_dir = self.check_directory(os.getcwd())
         self.extract_dir = self.extract_dir()
         self.filename: str = Path(zip_file_location).stem
@@ -58,13 +72,13 @@ class SsamEW:
             current_dir = self.current_dir
 
         output_dir = os.path.join(current_dir, 'output')
-        os.makedirs(output_dir, exist_ok=True)
+        ensure_dir(output_dir)
 
         figures_dir = os.path.join(current_dir, 'figures')
-        os.makedirs(figures_dir, exist_ok=True)
+        ensure_dir(figures_dir)
 
         ssam_dir = os.path.join(output_dir, 'ssam', self.nslc)
-        os.makedirs(ssam_dir, exist_ok=True)
+        ensure_dir(ssam_dir)
 
         return output_dir, figures_dir, ssam_dir
 
@@ -76,7 +90,7 @@ class SsamEW:
             output_dir = self.output_dir
 
         extract_dir = os.path.join(output_dir, 'extracted', subdir)
-        os.makedirs(extract_dir, exist_ok=True)
+        ensure_dir(extract_dir)
 
         return extract_dir
 
@@ -89,33 +103,47 @@ class SsamEW:
         end_date_date = Path(csv_files[-1]).stem
 
         for csv in csv_files:
-            df = pd.read_csv(csv)
+            df = pd.read_csv(csv, index_col='datetime')
             if not df.empty:
                 df_list.append(df)
 
-        df = pd.concat(df_list, ignore_index=True)
-        df = df.sort_values(by=['datetime'])
-        df.index = df['datetime']
+        # ISO datetimes sort as strings; duplicates are decided by the index only
+        df = pd.concat(df_list).sort_index(kind='stable')
+        df = df[~df.index.duplicated(keep='last')]
 
         filename = f'combined_{first_date}_{end_date_date}'
 
         extract_dir = self.extract_dir
         save_path = os.path.join(extract_dir, f'{filename}.csv')
 
-        df.to_csv(save_path, index=False)
+        df.to_csv(save_path, float_format='%.3f', chunksize=10_000)
 
         return save_path
 
-    def fix_date(self, date: str) -> datetime:
+    def fix_month(self, date: str) -> str:
         date = date.title()
         month = date.split('-')[1]
         if month in month_translator.keys():
             date = date.replace(month, month_translator[month])
 
-        date = datetime.strptime(date, '%d-%b-%Y %H:%M')
-
         return date
 
+    def fix_datetimes(self, dates: pa.ChunkedArray, times: pa.ChunkedArray) -> pa.Array:
+        # Dates and times repeat across rows, so translate and parse each distinct value once inside Arrow
+        dates = pc.dictionary_encode(dates).combine_chunks()
+        times = pc.dictionary_encode(times).combine_chunks()
+
+        # Only a handful of distinct days, so the month translation can stay in Python
+        days = pa.array([None if day is None else self.fix_month(day) for day in dates.dictionary.to_pylist()],
+                        type=pa.string())
+        days = pc.strptime(days, format='%d-%b-%Y', unit='ns', error_is_null=True)
+
+        # A bare '%H:%M' parses onto 1900-01-01, subtracting it leaves the time of day
+        minutes = pc.strptime(times.dictionary, format='%H:%M', unit='ns', error_is_null=True)
+        minutes = pc.subtract(minutes, pa.scalar(datetime(1900, 1, 1), pa.timestamp('ns')))
+
+        return pc.add(pc.take(days, dates.indices), pc.take(minutes, times.indices))
+
     def save_daily_csv(self, df: pd.DataFrame, extract_dir: str = None) -> list[str]:
         if extract_dir is None:
             extract_dir = self.extract_dir
@@ -125,25 +153,63 @@ class SsamEW:
         for groups in df.groupby(df.index.date):
             date, df = groups
             save_path = os.path.join(extract_dir, f'{date}.csv')
-            df.to_csv(save_path)
+            df.to_csv(save_path, float_format='%.3f', chunksize=10_000)
             daily_csvs.append(save_path)
 
         return daily_csvs
 
-    def extract_files(self, zip_file: ZipFile, text_file: ZipInfo, delimiter: str = None) -> list[str]:
+    def extract_files(self, zip_file: ZipFile, text_files: ZipInfo | list[ZipInfo], delimiter: str = None) -> list[str]:
         if delimiter is None:
             delimiter = self.delimiter
 
-        df = pd.read_csv(zip_file.open(text_file.filename), header=None, delimiter=delimiter)
+        if isinstance(text_files, ZipInfo):
+            text_files = [text_files]
+
+        if len(text_files) == 0:
+            return []
+
+        read_options = pacsv.ReadOptions(autogenerate_column_names=True)
+        # Incomplete lines are dropped, as dropna did for the pandas reader
+        parse_options = pacsv.ParseOptions(delimiter=delimiter, invalid_row_handler=lambda row: 'skip')
+        convert_options = pacsv.ConvertOptions(column_types={'f0': pa.string(), 'f1': pa.string()})
+
+        def read_table(text_file: ZipInfo) -> pa.Table:
+            # Decompress the member in one go and let Arrow parse the bytes without copying
+            return pacsv.read_csv(pa.BufferReader(zip_file.read(text_file.filename)), read_options=read_options,
+                                  parse_options=parse_options, convert_options=convert_options)
+
+        # Arrow decompresses and parses members in parallel without holding the GIL
+        with ThreadPoolExecutor(max_workers=max(1, min(len(text_files), os.cpu_count() or 1))) as executor:
+            # Start the largest members first so workers finish together, but keep archive order for dedup
+            order = sorted(range(len(text_files)), key=lambda index: text_files[index].file_size, reverse=True)
+            futures = {index: executor.submit(read_table, text_files[index]) for index in order}
+            tables = [futures[index].result() for index in range(len(text_files))]
 
-        df = df.dropna()
-        df['datetime'] = df[0] + ' ' + df[1]
-        df['datetime'] = df['datetime'].apply(self.fix_date)
-        df['datetime'] = pd.to_datetime(df['datetime'])
-        df = df.sort_values(by=['datetime'])
-        df.index = df['datetime']
-        df = df.drop(columns=[0, 1, 'datetime'])
-        df = df.drop_duplicates(keep='last')
+        table = pa.concat_tables(tables, promote_options='permissive')
+        del tables
+
+        datetimes = self.fix_datetimes(table.column(0), table.column(1))
+        table = table.drop_columns([table.column_names[0], table.column_names[1]])
+
+        df = table.to_pandas(self_destruct=True, split_blocks=True)
+        df.columns = range(2, df.shape[1] + 2)
+
+        # Rows without missing values or unparseable datetimes, as positions into the parsed frame
+        parsed_rows = pc.is_valid(datetimes).to_numpy(zero_copy_only=False)
+        unparsed_count = int(parsed_rows.size - parsed_rows.sum())
+        if unparsed_count > 0:
+            print(f'⚠️ Skip. {unparsed_count} rows with unparseable date or time')
+        valid_rows = np.flatnonzero(df.notna().all(axis=1).to_numpy() & parsed_rows)
+        datetimes = datetimes.to_numpy(zero_copy_only=False)[valid_rows]
+
+        # Stable sort, then keep the last row of every repeated datetime: dropna, sort and dedup in one take
+        order = np.argsort(datetimes, kind='stable')
+        sorted_datetimes = datetimes[order]
+        is_last = np.ones(sorted_datetimes.size, dtype=bool)
+        is_last[:-1] = sorted_datetimes[1:] != sorted_datetimes[:-1]
+
+        df = df.iloc[valid_rows[order[is_last]]]
+        df.index = pd.DatetimeIndex(sorted_datetimes[is_last], name='datetime')
 
         daily_csvs = self.save_daily_csv(df)
 
@@ -153,13 +219,9 @@ class SsamEW:
         if wildcard is None:
             wildcard = self.wildcard
 
-        files = []
-
-        zip_file = ZipFile(zip_file_location, 'r')
-
-        for text_file in zip_file.infolist():
-            if text_file.filename.endswith(wildcard):
-                files.extend(self.extract_files(zip_file, text_file, delimiter))
+        with ZipFile(zip_file_location, 'r') as zip_file:
+            text_files = [text_file for text_file in zip_file.infolist() if text_file.filename.endswith(wildcard)]
+            files = self.extract_files(zip_file, text_files, delimiter)
 
         return files
 
@@ -167,54 +229,123 @@ class SsamEW:
         if extract_dir is None:
             extract_dir = self.extract_dir
 
+        daily_csvs = [os.path.join(extract_dir, f"{date.strftime('%Y-%m-%d')}.csv") for date in dates]
+
+        # Another SsamEW for the same NSLC may rewrite the daily files, so their mtimes are part of the key
+        daily_mtimes = tuple(os.stat(daily_csv).st_mtime_ns if os.path.isfile(daily_csv) else None
+                             for daily_csv in daily_csvs)
+        cache_key = (tuple(dates), resample, extract_dir, daily_mtimes)
+        # Hand out copies so callers editing their frame never change what later plots read
+        if cache_key in self._df_cache:
+            return self._df_cache[cache_key].copy()
+
         df_list = []
 
-        for date in dates:
-            date_str = date.strftime('%Y-%m-%d')
-            daily_csv = os.path.join(extract_dir, f'{date_str}.csv')
+        for daily_csv in daily_csvs:
             try:
-                df = pd.read_csv(daily_csv, index_col='datetime', parse_dates=True)
+                df = pd.read_csv(daily_csv, index_col='datetime', parse_dates=True, engine='pyarrow')
+                df = df.astype(np.float32, copy=False)
                 if resample != '1min':
                     df = df.resample(resample).mean()
                 df_list.append(df)
             except FileNotFoundError:
                 print(f'⚠️ Skip. File not found: {daily_csv}')
 
-        df = pd.concat(df_list)
+        # Daily files share the same columns, so stack raw arrays instead of aligning frames with pd.concat
+        df = pd.DataFrame(
+            np.vstack([daily_df.to_numpy(dtype=np.float32, copy=False) for daily_df in df_list]),
+            index=pd.DatetimeIndex(np.concatenate([daily_df.index.to_numpy() for daily_df in df_list]), name='datetime'),
+            columns=df_list[0].columns,
+        )
 
         start_date = dates[0].strftime('%Y-%m-%d')
         end_date = dates[-1].strftime('%Y-%m-%d')
 
-        save_path = os.path.join(self.ssam_dir, f'ssam_{start_date}_{end_date}_{resample}.csv')
-        df.to_csv(save_path)
+        if self.save_merged:
+            save_path = os.path.join(self.ssam_dir, f'ssam_{start_date}_{end_date}_{resample}.{self.merged_format}')
+            if self.merged_format == 'parquet':
+                df.to_parquet(save_path, compression='zstd')
+            else:
+                df.to_csv(save_path, float_format='%.3f', chunksize=10_000)
+
+            print(f'✅ SSAM file saved at {save_path}')
 
-        print(f'✅ SSAM file saved at {save_path}')
-        return df
+        # Keep only the latest range, which is what repeated plot/plot_with_magma calls reuse
+        self._df_cache = {cache_key: df}
+
+        return df.copy()
+
+    @staticmethod
+    def max_bin(spectrogram: np.ndarray, x: np.ndarray, max_columns: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Downsample spectrogram along time by taking the maximum of each bin.
+
+        Args:
+            spectrogram (np.ndarray): Values with shape (frequencies, times)
+            x (np.ndarray): Times as matplotlib date numbers
+            max_columns (int): Maximum number of time bins
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: Binned spectrogram, bin center times
+        """
+        size = x.size
+        starts = np.arange(0, size, int(np.ceil(size / max_columns)))
+        counts = np.diff(np.append(starts, size))
+
+        spectrogram = np.fmax.reduceat(spectrogram, starts, axis=1)
+        x = np.add.reduceat(x, starts) / counts
+
+        return spectrogram, x
 
     def plot_ax(self, ax: plt.Axes, df: pd.DataFrame = None, interval: int = 1, color_map: str = 'jet_r',
-                value_min: float = 0.0, value_max: float = 50.0, frequencies: list[float] = None,) -> plt.Axes:
+                value_min: float = 0.0, value_max: float = 50.0, frequencies: list[float] = None,
+                max_columns: int = None, rasterized: bool = True) -> plt.Axes:
+
+        self._plot_mesh(ax, df=df, interval=interval, color_map=color_map, value_min=value_min, value_max=value_max,
+                        frequencies=frequencies, max_columns=max_columns, rasterized=rasterized)
+
+        return ax
+
+    def _plot_mesh(self, ax: plt.Axes, df: pd.DataFrame, interval: int = 1, color_map: str = 'jet_r',
+                   value_min: float = 0.0, value_max: float = 50.0, frequencies: list[float] = None,
+                   max_columns: int = None, rasterized: bool = True) -> QuadMesh:
 
         if frequencies is None:
             frequencies = np.array([0.0, 0.5, 1.0, 1.5, 2.0, 2.5, 3.0, 3.5, 4.0,
                                     4.5, 5.0, 5.5, 6.0, 8.0, 10.0, 15.0, 20])
 
-        ax.contourf(df.index, frequencies, df.values.T,
-                    levels=1000, cmap=color_map, vmin=value_min, vmax=value_max)
+        # Numeric dates skip matplotlib's per-element datetime conversion
+        x = mdates.date2num(df.index.to_numpy())
+
+        # Transpose once into contiguous float32 so matplotlib does not copy it again
+        spectrogram = np.ascontiguousarray(df.to_numpy(dtype=np.float32, copy=False).T)
+
+        # First and last sample with any value, taken before binning moves x to bin centres
+        x_valid = x[~np.isnan(spectrogram).all(axis=0)]
+        x_limits = (x_valid[0], x_valid[-1])
+
+        # Max-bin along time when there are more samples than the figure can show
+        if max_columns is not None and spectrogram.shape[1] > max_columns:
+            spectrogram, x = self.max_bin(spectrogram, x, max_columns)
+
+        mesh = ax.pcolormesh(x, frequencies, spectrogram,
+                             cmap=color_map, vmin=value_min, vmax=value_max, shading='auto', rasterized=rasterized)
 
         ax.set_ylabel('Frequency', fontsize=12)
         # ax.yaxis.set_major_locator(mticker.MultipleLocator(2))
         ax.set_ylim([0, 20])
 
         ax.set_xlabel('Datetime', fontsize=12)
+        ax.xaxis_date()
         ax.xaxis.set_major_locator(mdates.DayLocator(interval=interval))
         ax.xaxis.set_major_formatter(mdates.DateFormatter('%Y-%m-%d'))
-        ax.set_xlim(df.first_valid_index(), df.last_valid_index())
 
-        return ax
+        ax.set_xlim(*x_limits)
+
+        return mesh
 
     def plot(self, start_date: str, end_date: str, resample: str = None, title: str = None, width: int = 12, height: int = 6,
              interval: int = 1, color_map: str = 'jet_r', value_min: float = 0.0, value_max: float = 50.0,
-             frequencies: list[float] = None, save: bool = True) -> plt.Figure:
+             frequencies: list[float] = None, save: bool = True, dpi: int = 150, rasterized: bool = True) -> plt.Figure:
 
         if resample is None:
             resample = '1min'
@@ -224,12 +355,13 @@ class SsamEW:
         df = self.get_df(dates, resample)
 
         fig, ax = plt.subplots(figsize=(width, height), layout='constrained')
-        fig.colorbar(
-            plt.cm.ScalarMappable(norm=plt.Normalize(vmin=value_min, vmax=value_max), cmap=color_map),
-            ax=ax, pad=0.02)
 
-        ax = self.plot_ax(ax, df=df, interval=interval, color_map=color_map, value_min=0.0,
-                          value_max=value_max, frequencies=frequencies)
+        mesh = self._plot_mesh(ax, df=df, interval=interval, color_map=color_map, value_min=value_min,
+                               value_max=value_max, frequencies=frequencies, max_columns=int(width * dpi / 2),
+                               rasterized=rasterized)
+
+        # The spectrogram mesh already carries the norm and colormap
+        fig.colorbar(mesh, ax=ax, pad=0.02)
 
         if title is None:
             title = f'SSAM {self.nslc}'
@@ -241,7 +373,7 @@ class SsamEW:
 
         if save:
             save_path = os.path.join(self.figures_dir, f'ssam_{start_date}_{end_date}_{resample}.png')
-            fig.savefig(save_path, dpi=300)
+            fig.savefig(save_path, dpi=dpi)
             print(f'📈 Graphics saved to {save_path}')
 
         return fig
@@ -250,7 +382,7 @@ class SsamEW:
                         resample: str = None, interval: int = 1, color_map: str = 'jet_r',
                         value_min: float = 0.0, value_max: float = 50.0, frequencies: list[float] = None,
                         earthquake_events: str | list[str] = None, width: int = 12, height: int = None,
-                        y_locator: int = None, height_ratios=None) -> None:
+                        y_locator: int = None, height_ratios=None, dpi: int = 150, rasterized: bool = True) -> None:
         """Plot SSAM with MAGMA.
 
         Args:
@@ -269,11 +401,15 @@ class SsamEW:
             height (int): Height for figure.
             y_locator (int): Y interval for MAGMA Plot.
             height_ratios (list[float]): Height ratios for between SSAM and MAGMA figure.
+            dpi (int): Resolution of the saved figure. Default 150, use 300 for publication.
+            rasterized (bool): Rasterize the SSAM mesh when saving. Default True.
 
         Returns:
             None
         """
 
+        from .magma import Plot
+
         if height_ratios is None:
             height_ratios = [1, 0.2]
 
@@ -289,8 +425,8 @@ class SsamEW:
         magma_plot = Plot(
             token=token,
             volcano_code=volcano_code,
-            start_date=str(df_ssam.first_valid_index()).split(' ')[0],
-            end_date=str(df_ssam.last_valid_index()).split(' ')[0],
+            start_date=valid_start_date.strftime('%Y-%m-%d'),
+            end_date=valid_end_date.strftime('%Y-%m-%d'),
             earthquake_events=earthquake_events,
         )
 
@@ -304,31 +440,31 @@ class SsamEW:
 
         fig_magma.subplots_adjust(hspace=0.0)
         fig_magma.supylabel('Jumlah')
-        axs_magma = fig_magma.subplots(nrows=len(df_magma.columns), ncols=1, sharex=True)
-        for gempa, column_name in enumerate(df_magma.columns):
-            axs_magma[gempa].bar(df_magma.index, df_magma[column_name], width=0.5, label=column_name,
-                                 color=colors[column_name], linewidth=0)
-            axs_magma[gempa].set_ylim([0, df_magma[column_name].max() * 1.2])
-            axs_magma[gempa].set_xlim(valid_start_date, valid_end_date)
-
-            if y_locator is not None and df_magma[column_name].max() > y_locator:
-                axs_magma[gempa].yaxis.set_major_locator(mticker.MultipleLocator(y_locator))
+        axs_magma = fig_magma.subplots(nrows=len(df_magma.columns), ncols=1, sharex=True, squeeze=False)[:, 0]
+
+        Plot.plot_events(
+            axs=axs_magma,
+            x=mdates.date2num(df_magma.index.to_numpy()),
+            y=df_magma.to_numpy(),
+            labels=list(df_magma.columns),
+            interval=interval,
+            y_locator=y_locator
+        )
 
-            axs_magma[gempa].xaxis.set_major_locator(mdates.DayLocator(interval=interval))
-            axs_magma[gempa].yaxis.get_major_ticks()[0].label1.set_visible(False)
-            axs_magma[gempa].legend(loc=2)
-            axs_magma[gempa].tick_params(labelbottom=False)
+        axs_magma[-1].set_xlim(valid_start_date, valid_end_date)
+        axs_magma[-1].tick_params(labelbottom=False)
 
         ax_ssam = fig_ssam.subplots(nrows=1, ncols=1)
         self.plot_ax(ax_ssam, df=df_ssam, interval=interval, color_map=color_map, value_min=value_min,
-                          value_max=value_max, frequencies=frequencies)
+                     value_max=value_max, frequencies=frequencies, max_columns=int(width * dpi / 2),
+                     rasterized=rasterized)
 
         plt.tight_layout()
         plt.tick_params(axis='both', which='major', labelsize=10)
         plt.xticks(rotation=60)
 
         save_path = os.path.join(self.figures_dir, f'ssam_magma_{start_date}_{end_date}_{resample}.png')
-        fig.savefig(save_path, dpi=300)
+        fig.savefig(save_path, dpi=dpi)
         print(f'📈 Graphics saved to {save_path}')
 
         plt.show()
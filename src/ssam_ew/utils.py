@@ -0,0 +1,20 @@
+import os
+
+# Directories already created in this process
+_ensured_dirs: set[str] = set()
+
+
+def ensure_dir(path: str) -> str:
+    """Create directory once per process.
+
+    Args:
+        path (str): Directory path
+
+    Returns:
+        str: Directory path
+    """
+    if path not in _ensured_dirs:
+        os.makedirs(path, exist_ok=True)
+        _ensured_dirs.add(path)
+
+    return path